@@ -5,7 +5,8 @@
 #              implement the BM25 alogrithm information retrieval;
 #              also 5 evaluation methods (precision, recall, MAP, P at N and
 #              NDCG at N) are applied.
-#              Tested under Python 3.5 on Ubuntu 16.04.
+#              Tested under Python 3.5 on Ubuntu 16.04; Python 3.7 or later is
+#              required to run queries in worker processes (`-j` option).
 # Author: '(Yungchen J.)
 # Date created: 2018-05-07
 
@@ -16,11 +17,20 @@ import argparse
 import readline
 # Used to create a typing history buffer for `manual` mode.
 # More details are here: https://docs.python.org/3/library/readline.html
-import json
-# Used to create a human-readable JSON file for index information and the like.
+import pickle
+# Used to store index information and the like in a binary file, which is
+# much faster to load than a JSON one.
+import array
+# Used to store posting lists as compact arrays of machine integers.
 import string # Used to do some regex operations.
+import re # Used to split texts into sections by labels.
 import math
 import os
+import sys # Used to exit with an error message and to intern strings.
+import heapq # Used to select top results without sorting all of them.
+import functools # Used to memoise stemming results.
+import collections # Used to count appearance times of terms.
+import concurrent.futures # Used to run queries in parallel in `evaluation` mode.
 
 # Here are some Python libraries that places locally.
 import porter
@@ -29,8 +39,11 @@ STOP_WORDS_PATH = "stopwords.txt"
 DOCUMENT_PATH = "./cran/cran.all.1400"
 QUERY_PATH = "./cran/cran.qry"
 RELEVANCE_PATH = "./cran/cranqrel"
-INDEX_PATH = "index.json"
+INDEX_PATH = "index.pickle"
 EVALUATION_PATH = "evaluation_output.txt"
+INDEX_VERSION = 5
+# It is stored as the first item of the index file and has to be increased
+# whenever the layout of the index changes, so that outdated files are detected.
 
 # Labels in `cran.all.1400` and `cranqrel` text files.
 ID = ".I"
@@ -38,14 +51,26 @@ TITLE = ".T"
 AUTHORS = ".A"
 BIBLIOGRAPHY = ".B"
 WORDS = ".W"
-LABELS = [ID, TITLE, AUTHORS, BIBLIOGRAPHY, WORDS]
-CONTENTS = [AUTHORS, BIBLIOGRAPHY, WORDS]
+LABELS = frozenset([ID, TITLE, AUTHORS, BIBLIOGRAPHY, WORDS])
+CONTENTS = frozenset([AUTHORS, BIBLIOGRAPHY, WORDS])
+LABEL_PATTERN = re.compile("^(" + "|".join(re.escape(label) for label in LABELS) + ")", re.MULTILINE)
+# It matches labels at the beginning of lines, which are used to split texts
+# into sections.
 
 DELIMITER_SYMBOL = "*"
 BOUNDARY_LENGTH = 80
 # It decides the length of the boundary between two `manual` queries.
 MOST_RELEVANT = 15
 # At most top `MOST_RELEVANT` results are returned for each query.
+STEMMING_CACHE_SIZE = 50000
+# At most `STEMMING_CACHE_SIZE` stemming results are cached, which is several
+# times the number of distinct words in Cranfield collection (about 10,000)
+# while keeping memory bounded during a long `manual` session.
+MAX_JOBS = 61
+# The upper limit of worker processes of `ProcessPoolExecutor` on Windows.
+QUERY_CACHE_SIZE = 1024
+# At most `QUERY_CACHE_SIZE` queries typed in `manual` mode and their results
+# are cached.
 USER_STOP_WORD = "QUIT"
 # When user types `USER_STOP_WORD`, the program ends; it is case-sensitive.
 RELEVANCE_SCORE_THRESHOLD = 4
@@ -59,213 +84,261 @@ RELEVANCE_SCORE_FIX = 5
 # Constants used in BM25 model.
 K = 1.0
 B = 0.75
+COMMON_TERM_THRESHOLD = 0.5
+# Terms appearing in more than `COMMON_TERM_THRESHOLD` of all documents are
+# left out of the index. With the default value, those are exactly the terms
+# with a negative IDF, which barely tell documents apart.
 
 # A constant used in Precision at N and NDCG at N.
 # If `MOST_RELEVANT` is equal to `N`, precision will be the same as P at N for Cranfield collection.
 # N.B.: `N` cannot be larger than `MOST_RELEVANT`.
 N = 10
 
-def is_number(word):
-	""" A helper function to check if a string can be converted to an integer.
-        Used to process documents and queries.
+DISCOUNTS = [1.0] + [math.log(i + 1, 2) for i in range(1, MOST_RELEVANT)]
+# Discount divisors used by DCG and IDCG for results at positions 1 to
+# `MOST_RELEVANT`; the first result is not discounted. They are the same
+# for every query, so they are calculated only once.
+
+@functools.lru_cache(maxsize = STEMMING_CACHE_SIZE)
+def stem(word):
+	""" A helper function to stem a word with results cached, since the same
+        words appear again and again in documents and queries.
 	"""
-	try:
-		int(word)
-		return True
-	except ValueError:
-		return False
-
-def is_valid(word):
-	""" A helper function to check if a string is valid.
-        Used to process documents and queries.
+	return sys.intern(stemmer.stem(word))
+	# Intern stemmed words so that different words with the same stem share
+	# one string object as the key of posting lists.
+
+def positive_integer(text):
+	""" A helper function to check the value of `-j` option.
+        Used by `get_arguments` function.
 	"""
-	if word != "" and word not in stop_words and not is_number(word):
-		return True
-	else:
-		return False
+	value = int(text)
+	if value < 1:
+		raise argparse.ArgumentTypeError("{0} is not a positive integer".format(text))
+	return value
 
 def get_arguments():
-	parser = argparse.ArgumentParser(description = "A script used to build BM25 model and relative evaluation methods. If the index JSON file is not available, just type `python3 bm25.py` to generate one in the working directory and extra arguments will be ignored in this case")
+	parser = argparse.ArgumentParser(description = "A script used to build BM25 model and relative evaluation methods. If the index file is not available, just type `python3 bm25.py` to generate one in the working directory and extra arguments will be ignored in this case")
 	parser.add_argument("-m", required = False, choices = ["manual", "evaluation"], default = "manual", help = "mode selection; `manual` mode is chosen by default if it is not specified")
 	parser.add_argument("-o", required = False, nargs = "?", const = EVALUATION_PATH, metavar = "FILE NAME", help = "BM25 evaluation result output in lines of 3-tuples (query ID, document ID, and its rank [1 - 15]) form; if `FILE NAME` is not given, the default output file name is `evaluation_output.txt`")
+	parser.add_argument("-j", required = False, type = positive_integer, default = 1, metavar = "JOBS", help = "number of worker processes used to run queries in `evaluation` mode, which is at most the number of CPUs; queries are run in the current process by default")
 	return parser.parse_args()
 
 def load_stop_words():
-	stop_words = set()
 	with open(STOP_WORDS_PATH, "r") as fp:
-		for line in fp:
-			stop_words.add(line.rstrip())
-	return stop_words
+		return frozenset(sys.intern(line.rstrip()) for line in fp)
+		# It is only used for membership checks of every word.
 
-def process_documents():
-	""" Build vectors of each term and calculate lengths of each documents.
-        Also a dictionary containing pairs of original words and stemmed words
-        are returned.
+def split_sections(text):
+	""" A helper function to split a text in the format of Cranfield collection
+        into pairs (Label, Content), where content is the text between the line
+        of the label and the next line beginning with a label.
+        Used to process documents and queries.
 	"""
-	def add_new_word(word):
-	# A helper function to add a new word in `term_vectors`.
-		if word not in stemming:
-			stemming[word] = stemmer.stem(word)
-		stemmed_word = stemming[word]
-		if stemmed_word not in term_vectors:
-			term_vectors[stemmed_word] = {}
-		if document_ID in term_vectors[stemmed_word]:
-			(term_vectors[stemmed_word])[document_ID] += 1
-		else:
-			term_vectors[stemmed_word].update({document_ID : 1})
+	pieces = LABEL_PATTERN.split(text)
+	# `pieces` looks like [Text Before The First Label, Label, Rest, Label, Rest, ...].
+	for i in range(1, len(pieces), 2):
+		yield pieces[i], pieces[i + 1].partition("\n")[2]
+		# Anything following a label on the same line, like the original IDs
+		# after ".I", is ignored.
 
-	stemming = {}
-	term_vectors = {}
-	# `term_vectors` structure: {[Key] Term : [Value] {[Key] Document ID : [Value] Appearance Times}}.
-	document_lengths = {}
+def process_documents():
+	""" Build vectors of each term and calculate lengths of each documents,
+        which are then turned into BM25 weights of every (term, document) pair.
+        The weights are returned with the number of documents.
+	"""
+	def add_document_terms():
+	# A helper function to count terms of the current document and merge them
+	# into `term_vectors`, touching each posting list once per document.
+		for term, appearance_times in collections.Counter(document_terms).items():
+			term_vectors[term][document_ID] = appearance_times
+
+	term_vectors = collections.defaultdict(dict)
+	# `term_vectors` structure: {[Key] Term : [Value] {[Key] Document ID : [Value] Appearance Times}},
+	# and it is only used while indexing to build `term_weights`.
+	document_lengths = array.array("d")
+	# Lengths are stored in a flat array indexed by document ID.
 	average_length = 0.0
 	num_of_documents = 0
 	with open(DOCUMENT_PATH, "r") as fp:
-		document_ID = 0
-		length = 0.0
-		for line in fp:
-			current_section = line[0 : 2]
-			if current_section in LABELS:
-				if current_section == ID:
-					document_lengths[document_ID] = math.sqrt(length)
-					# Calculate the previous document length and start a new one.
-					# The empty entry for document 0 is also created although
-					# in Cranfield collection, document ID begins from 001.
-					average_length += document_lengths[document_ID]
-					document_ID += 1
-					# Ignore original document IDs, which is the numbers followed by ".I",
-					# since they may not be consecutive.
-					num_of_documents += 1
-					length = 0.0
-				section = current_section
-				continue # Update and go to next line immediately.
-			elif section in CONTENTS:
-				line = line.translate(removing_punctuation_map)
-				line = line.replace("--", " ")
-				# Also, treat two consecutive hyphens as a space.
-				for term in line.split():
-				# Split according to whitespace characters and deal with two special cases:
-				# abbreviations with "." and hyphenated compounds.
-					term = term.replace(".", "")
-					# Remove full stops in one term, used to convert abbreviations
-					# like "m.i.t." (line 1222) / "u.s.a." (line 32542) into "mit" / "usa".
-					# In the meantime, something like "..e.g.at" (line 17393),
-					# "i.e.it" (line 17287), "trans.amer.math.soc.33" (line 31509),
-					# or "studies.dash" (line 516) will not be handled as expected.
-					# All float-point numbers like "3.2x10" (line 18799), "79.5degree"
-					#  (line 20026) will be converted into integers by just removing dots.
-					# And similarly, phrases like "m. i. t." (line 36527) and
-					# "i. e." (line 11820) will be ignored.
-					# "r.m.s." (line 20241) will become "rm" stored in the dictionary after stemming.
-					compound = term.replace("-", "")
-					if is_valid(compound):
-						add_new_word(compound)
-						if section == WORDS:
-							length += 1.0
-							# Treat a compound word as one word; words in `AUTHORS`
-							# and `BIBLIOGRAPHY` section will not be counted.
+		text = fp.read()
+		# Read the whole collection at once; it is only about 1.6 MB.
+	document_ID = 0
+	document_terms = []
+	# Stemmed terms of the current document, in order of appearance.
+	add_new_word = document_terms.append
+	ignored_words = stop_words
+	# Bind the stop words to a local name, as they are checked for every word.
+	length = 0.0
+	for section, content in split_sections(text):
+	# Each section is processed as a whole instead of line by line.
+		if section == ID:
+			add_document_terms()
+			document_terms.clear()
+			document_lengths.append(math.sqrt(length))
+			# Calculate the previous document length and start a new one.
+			# The empty entry for document 0 is also created although
+			# in Cranfield collection, document ID begins from 001.
+			average_length += document_lengths[document_ID]
+			document_ID += 1
+			# Ignore original document IDs, which is the numbers followed by ".I",
+			# since they may not be consecutive.
+			num_of_documents += 1
+			length = 0.0
+		elif section in CONTENTS:
+			content = content.translate(translation_map)
+			# Full stops are removed by the translation, used to convert abbreviations
+			# like "m.i.t." (line 1222) / "u.s.a." (line 32542) into "mit" / "usa".
+			# In the meantime, something like "..e.g.at" (line 17393),
+			# "i.e.it" (line 17287), "trans.amer.math.soc.33" (line 31509),
+			# or "studies.dash" (line 516) will not be handled as expected.
+			# All float-point numbers like "3.2x10" (line 18799), "79.5degree"
+			#  (line 20026) will be converted into integers by just removing dots.
+			# And similarly, phrases like "m. i. t." (line 36527) and
+			# "i. e." (line 11820) will be ignored.
+			# "r.m.s." (line 20241) will become "rm" stored in the dictionary after stemming.
+			content = content.replace("--", " ")
+			# Also, treat two consecutive hyphens as a space.
+			for term in content.split():
+			# Split according to whitespace characters and deal with hyphenated compounds.
+				compound = term.replace("-", "")
+				if compound and compound not in ignored_words and not compound.isdecimal():
+				# Keep non-empty words which are neither stop words nor pure integers;
+				# signs cannot appear here since "+" is translated into a space
+				# and hyphens have been removed.
+					add_new_word(stem(compound))
+					if section == WORDS:
+						length += 1.0
+						# Treat a compound word as one word; words in `AUTHORS`
+						# and `BIBLIOGRAPHY` section will not be counted.
+					if "-" in term:
+					# Only split terms with hyphens, which avoids creating a one-item list for every term.
+					# There may exist a term with an ending hyphens like
+					# "sub- and" (line 14632), which causes an extra empty string is created
+					# and makes term_split look like ["sub", ""].
 						term_split = term.split("-")
-						if len(term_split) > 1:
-						# If only one item in `term_split`, which means there is no hyphen in this word.
-						# There may exist a term with an ending hyphens like
-						# "sub- and" (line 14632), which causes an extra empty string is created
-						# and makes term_split look like ["sub", ""].
-							for element in term_split:
-							# Deal with each part of compound words like "two-step" (line 38037) or
-							# type names like "75s-t6" (line 28459) or "a52b06" (line 25717).
-								if is_valid(element):
-									add_new_word(element)
-									# Filter out all pure integers; for example, for "f8u-3" (line 35373),
-									# both "f8u" and "f8u3" will be saved, but not "3".
-
-	# Calculate the last length since Cranfield collection does not have ending symbols.
-	document_lengths[document_ID] = math.sqrt(length)
-	# Skip the document with index 0 from document length vector.
-	del document_lengths[0]
+						for element in term_split:
+						# Deal with each part of compound words like "two-step" (line 38037) or
+						# type names like "75s-t6" (line 28459) or "a52b06" (line 25717).
+							if element and element not in ignored_words and not element.isdecimal():
+								add_new_word(stem(element))
+								# Filter out all pure integers; for example, for "f8u-3" (line 35373),
+								# both "f8u" and "f8u3" will be saved, but not "3".
+
+	# Add the last document's terms and calculate its length since Cranfield
+	# collection does not have ending symbols.
+	add_document_terms()
+	document_lengths.append(math.sqrt(length))
 	average_length = (document_lengths[document_ID] + average_length) / num_of_documents
-	for document in document_lengths.keys():
+	for document in range(1, num_of_documents + 1):
 		document_lengths[document] = document_lengths[document] / average_length
-		# Now document_lengths stores a normalised length for each document.
-
-	return stemming, term_vectors, document_lengths
+		# Now document_lengths stores a normalised length for each document;
+		# the entry for document 0 is kept as 0.0 so that indices match IDs.
+
+	normalisation_factors = [K * ((1.0 - B) + B * length) for length in document_lengths]
+	# The document-only part of the BM25 denominator, indexed by document ID.
+	k_plus_one = 1.0 + K
+	# The numerator factor is the same for every posting.
+	term_weights = {}
+	# `term_weights` structure: {[Key] Term : [Value] ([Document IDs], [BM25 Weights])}.
+	for term, vector in term_vectors.items():
+	# BM25 weights do not depend on queries, so they are calculated once here
+	# and stored in the index, and scoring a query only needs to add them up.
+		n_i = len(vector)
+		if n_i > COMMON_TERM_THRESHOLD * num_of_documents:
+			continue
+			# Skip very common terms; they do not contribute to scores of queries
+			# either, since only terms in the index are scored.
+		idf = math.log2((num_of_documents - n_i + 0.5) / (n_i + 0.5))
+		weights = [frequency * k_plus_one / (frequency + normalisation_factors[document]) * idf for document, frequency in vector.items()]
+		term_weights[term] = (array.array("I", vector.keys()), array.array("d", weights))
+		# Convert each posting list into two parallel arrays of document IDs
+		# (unsigned int) and weights (double), which take 12 bytes per posting
+		# in the index file. Document IDs are already in ascending order since
+		# documents are read sequentially.
+
+	return term_weights, num_of_documents
 
 def process_single_query(query):
-	""" Process single line text.
+	""" Process single line text and count appearance times of each term.
         Used by `process_queries` function and `manual` mode.
 	"""
-	def add_new_word(word):
-	# A helper function to add a new word in `query_terms`.
-		if word not in stemming:
-			stemming[word] = stemmer.stem(word)
-		stemmed_word = stemming[word]
-		if stemmed_word not in query_terms:
-			query_terms.append(stemmed_word)
-
-	query_terms = []
-	query = query.strip()
-	query = query.translate(removing_punctuation_map)
+	query_words = []
+	# Stemmed terms of the query, in order of appearance.
+	add_new_word = query_words.append
+	ignored_words = stop_words
+	query = query.translate(translation_map)
 	query = query.replace("--", " ")
 	for term in query.split():
-		term = term.replace(".", "").lower()
 		compound = term.replace("-", "")
-		if is_valid(compound):
-			add_new_word(compound)
-			term_split = term.split("-")
-			if len(term_split) > 1:
-				for element in term_split:
-					if is_valid(element):
-						add_new_word(element)
-	return query_terms
+		if compound and compound not in ignored_words and not compound.isdecimal():
+		# The same check as in `process_documents` function.
+			add_new_word(stem(compound))
+			if "-" in term:
+				for element in term.split("-"):
+					if element and element not in ignored_words and not element.isdecimal():
+						add_new_word(stem(element))
+	return collections.Counter(query_words)
+	# The returned structure: {[Key] Term : [Value] Appearance Times}.
 
 def process_queries():
 	with open(QUERY_PATH, "r") as fp:
-		query_list = {}
-		query = []
-		query_ID = 0
-		for line in fp:
-			current_section = line[0 : 2]
-			if current_section in LABELS:
-				if current_section == ID:
-					query_list[query_ID] = query
-					query = []
-					query_ID += 1
-					# Ignore original query IDs, which is the numbers followed
-					# by ".I", since they are not consecutive.
-				if current_section == WORDS:
-					section = current_section
-				continue
-			elif section in CONTENTS:
-				if query == []:
-					query = process_single_query(line)
-				else:
-					query += process_single_query(line)
-		query_list[query_ID] = query # Add the last entry.
-		del query_list[0] # Skip the first one.
+		text = fp.read()
+	query_list = {}
+	query = collections.Counter()
+	query_ID = 0
+	for section, content in split_sections(text):
+		if section == ID:
+			query_list[query_ID] = query
+			query = collections.Counter()
+			query_ID += 1
+			# Ignore original query IDs, which is the numbers followed
+			# by ".I", since they are not consecutive.
+		elif section == WORDS:
+			query.update(process_single_query(content))
+			# The whole multi-line query is processed at once.
+	query_list[query_ID] = query # Add the last entry.
+	del query_list[0] # Skip the first one.
 	return query_list
 
 def bm25_similarities(query):
 	""" It returns a descending list with at most top `MOST_RELEVANT` pairs 
         (Document ID, Similarity) based on BM25 to calculate similarities.
 	"""
-	similarities = []
-	for document_ID in range(1, nums_of_documents + 1):
-	# Document ID begins from 1.
-		similarity = 0.0
-		for term in query:
-			if term in term_vectors and document_ID in term_vectors[term]:
-				frequency = (term_vectors[term])[document_ID]
-				n_i = len(term_vectors[term])
-				idf = math.log((nums_of_documents - n_i + 0.5) / (n_i + 0.5), 2)
-				similarity += frequency * (1.0 + K) / (frequency + K * ((1.0 - B) + B * document_lengths[document_ID])) * idf
-		if similarity > 0.0: # Ignore the one with similarity score 0.
-			pair = (document_ID, similarity)
-			similarities.append(pair)
-	# Sort results in desceding order.
-	similarities = sorted(similarities, key = lambda x : x[1], reverse = True)
-	if len(similarities) > MOST_RELEVANT:
-		return similarities[0 : MOST_RELEVANT]
-	else:
-		return similarities
+	scores = [0.0] * (nums_of_documents + 1)
+	# Document ID begins from 1, so the entry with index 0 is never used.
+	for term, appearance_times in query.items():
+		if term in term_weights:
+		# Only walk the posting list of each query term instead of scanning
+		# every document, as documents without any query term score 0.
+			document_IDs, weights = term_weights[term]
+			if appearance_times == 1:
+			# Most query terms appear once, so skip the multiplication for them.
+				for document_ID, weight in zip(document_IDs, weights):
+					scores[document_ID] += weight
+			else:
+				for document_ID, weight in zip(document_IDs, weights):
+					scores[document_ID] += weight * appearance_times
+					# A term repeated in the query contributes once per appearance.
+	top_IDs = heapq.nlargest(MOST_RELEVANT, range(1, nums_of_documents + 1), key = scores.__getitem__)
+	# Select document IDs of the top `MOST_RELEVANT` scores in descending order
+	# directly from the score list rather than building (ID, Score) pairs for
+	# all documents first; IDs are visited in ascending order and the selection
+	# is stable, so ties are broken as before.
+	return [(document_ID, scores[document_ID]) for document_ID in top_IDs if scores[document_ID] > 0.0]
+	# Ignore the ones with similarity score 0 or below, which covers all
+	# documents without any query term; the positive ones always come first.
+
+@functools.lru_cache(maxsize = QUERY_CACHE_SIZE)
+def search(user_query):
+	""" A helper function to process a query typed by users and return its terms
+        and results, which are cached since the same queries are often typed
+        again in a `manual` session. Used in `manual` mode.
+	"""
+	query_terms = process_single_query(user_query)
+	return [term for term in query_terms if term in term_weights], bm25_similarities(query_terms)
+	# Only terms in the index are listed, since the others, including very
+	# common terms left out of it, do not contribute to any score.
 
 def manual_mode():
 	""" When in `manual` mode, the function will not end until user types "QUIT".
@@ -277,99 +350,97 @@ def manual_mode():
 		user_query = input("Enter query (type \"QUIT\" to terminate): ")
 		if user_query == USER_STOP_WORD:
 			break
-		query_terms = process_single_query(user_query)
+		query_terms, results = search(user_query.strip().lower())
+		# Neither surrounding whitespace nor letter case changes the query, so
+		# they are normalised to let such queries share one cache entry.
 		print("Results for query " + str(query_terms))
 		print("Rank\tID\tScore")
 		rank = 1
-		for result in bm25_similarities(query_terms):
+		for result in results:
 			print("{0}\t{1}\t{2}".format(str(rank), result[0], str(result[1])), end = "\n")
 			rank += 1
 
 def load_relevance_scores():
-	relevance_scores = {}
+	relevance_scores = collections.defaultdict(list)
 	# `relevance_scores` structure: {[KEY] query ID : [Value] [(Document ID, Relevance Score)]}
 	with open(RELEVANCE_PATH, "r") as fp:
 		for line in fp:
 			fields = line.split()
-			query_ID = int(fields[0])
-			pair = (int(fields[1]), int(fields[2]))
-			if query_ID in relevance_scores:
-				relevance_scores[query_ID].append(pair)
-				# It assumes no repetition of document IDs for each query.
-			else:
-				relevance_scores[query_ID] = [pair]
+			relevance_scores[int(fields[0])].append((int(fields[1]), int(fields[2])))
+			# It assumes no repetition of document IDs for each query.
 
-	for query_ID in relevance_scores:
+	for pairs in relevance_scores.values():
 	# Sort pairs in ascending order for each query; the less the relevance
 	# score is, the more relevant the document is.
-		relevance_scores[query_ID] = sorted(relevance_scores[query_ID], key = lambda x : x[1])
-	return relevance_scores
+		pairs.sort(key = lambda x : x[1])
+	return dict(relevance_scores)
+
+def initialise_worker(weights, number_of_documents):
+	""" Set global variables used by `bm25_similarities()` in a worker process,
+        since they are only defined when the script runs as `__main__`.
+	"""
+	global term_weights, nums_of_documents
+	term_weights = weights
+	nums_of_documents = number_of_documents
 
-def make_query_results():
+def make_query_results(jobs):
 	""" It returns possible relevant documents for each query based on BM25 model.
+        Queries are independent of each other, so they are spread over `jobs`
+        worker processes if `jobs` is larger than 1.
 	"""
 	query_list = process_queries()
+	jobs = min(jobs, os.cpu_count() or 1, MAX_JOBS)
+	# More processes than CPUs do not help, and Windows does not allow more
+	# than `MAX_JOBS` worker processes.
 	query_results = {}
 	# `query_results` structure: {[KEY] query ID : [Value] [(Document ID, Relevance Score)]}, which is exactly the same structure and length as `relevance_scores`.
-	for query_ID in query_list:
+	if jobs > 1:
+		with concurrent.futures.ProcessPoolExecutor(max_workers = jobs, initializer = initialise_worker, initargs = (term_weights, nums_of_documents)) as executor:
+			similarities = list(executor.map(bm25_similarities, query_list.values(), chunksize = len(query_list) // (jobs * 4) + 1))
+	else:
+		similarities = map(bm25_similarities, query_list.values())
+	for query_ID, pairs in zip(query_list, similarities):
 		rank = 1
 		query_results[query_ID] = []
-		for pair in bm25_similarities(query_list[query_ID]):
+		for pair in pairs:
 			query_results[query_ID].append((pair[0], rank))
 			rank += 1
 	return query_results
 
 def make_relevance_set(query_ID): # Relevant documents (Rel).
-	relevance_set = set()
-	for pair in relevance_scores[query_ID]:
-		if pair[1] <= RELEVANCE_SCORE_THRESHOLD:
-		# We only include queries whose relevance scores are less than or equal
-		# to `RELEVANCE_SCORE_THRESHOLD` here.
-			relevance_set.add(pair[0])
-	return relevance_set
+	return frozenset(pair[0] for pair in relevance_scores[query_ID] if pair[1] <= RELEVANCE_SCORE_THRESHOLD)
+	# We only include queries whose relevance scores are less than or equal
+	# to `RELEVANCE_SCORE_THRESHOLD` here.
 
 def make_retrieval_set(query_ID): # Retrieval documents (Ret).
-	retrieval_set = set()
-	for pair in query_results[query_ID]:
-		retrieval_set.add(pair[0])
-	return retrieval_set
+	return frozenset(pair[0] for pair in query_results[query_ID])
 
-def precision():
+def precision(relevance_sets, retrieval_sets):
 	""" It calculates arithmetic mean of precisions for all queries.
 	"""
 	precision = 0.0
-	for query_ID in relevance_scores:
-		relevance_set = make_relevance_set(query_ID)
-		retrieval_set = make_retrieval_set(query_ID)
-		appearance_times = 0
-		for document_ID in retrieval_set:
-			if document_ID in relevance_set:
-				appearance_times += 1
+	for query_ID, relevance_set in relevance_sets.items():
+		retrieval_set = retrieval_sets[query_ID]
+		appearance_times = len(retrieval_set & relevance_set)
 		precision += appearance_times / len(retrieval_set)
 	precision = precision / len(query_results)
 	return precision
 
-def recall():
+def recall(relevance_sets, retrieval_sets):
 	""" It calculates arithmetic mean of recalls for all queries.
 	"""
 	recall = 0.0
-	for query_ID in relevance_scores:
-		relevance_set = make_relevance_set(query_ID)
-		retrieval_set = make_retrieval_set(query_ID)
-		appearance_times = 0
-		for document_ID in relevance_set:
-			if document_ID in retrieval_set:
-				appearance_times += 1
+	for query_ID, relevance_set in relevance_sets.items():
+		appearance_times = len(retrieval_sets[query_ID] & relevance_set)
 		recall += appearance_times / len(relevance_set)
 	recall = recall / len(query_results)
 	return recall
 
-def p_at_n(n):
+def p_at_n(relevance_sets, n):
 	""" It calculates arithmetic mean of precisions at N for all queries.
 	"""
 	p_at_n = 0.0
-	for query_ID in relevance_scores:
-		relevance_set = make_relevance_set(query_ID)
+	for query_ID, relevance_set in relevance_sets.items():
 		appearance_times = 0
 		for pair in query_results[query_ID]:
 			if pair[0] in relevance_set and pair[1] <= n:
@@ -378,12 +449,11 @@ def p_at_n(n):
 	p_at_n = p_at_n / len(query_results)
 	return p_at_n
 
-def mean_average_precision():
+def mean_average_precision(relevance_sets):
 	""" It calculates mean average precision for all queries.
 	"""
 	mean_average_precision = 0.0
-	for query_ID in relevance_scores:
-		relevance_set = make_relevance_set(query_ID)
+	for query_ID, relevance_set in relevance_sets.items():
 		appearance_times = 0
 		current_map = 0.0
 		for pair in query_results[query_ID]:
@@ -394,11 +464,11 @@ def mean_average_precision():
 	mean_average_precision = mean_average_precision / len(query_results)
 	return mean_average_precision
 
-def ndcg_at_n(n):
+def ndcg_at_n(relevance_sets, n):
 	""" It yields a list of NDCGs at up to N of each query separately.
 	"""
 	for query_ID, score_list in relevance_scores.items():
-		relevance_set = make_relevance_set(query_ID)
+		relevance_set = relevance_sets[query_ID]
 		score_list_dict = dict(score_list)
 		# Convert a list of pairs to dictionary for convienence.
 
@@ -415,15 +485,16 @@ def ndcg_at_n(n):
 		dcg = [gain_vector[0]]
 		# Put the first item in `dcg`.
 		for i in range(1, len(gain_vector)):
-			dcg.append(gain_vector[i] / math.log(i + 1, 2) + dcg[-1])
+			dcg.append(gain_vector[i] / DISCOUNTS[i] + dcg[-1])
 
 		# Step three: IDCG (Ideal Discounted Cumulated Gain).
 		ideal_gain_vector = []
-		for pair in score_list:
-			ideal_gain_vector.append(RELEVANCE_SCORE_FIX - score_list_dict[pair[0]])
+		for pair in score_list[0 : len(gain_vector)]:
+		# Only as many positions as `dcg` has are used to calculate NDCG.
+			ideal_gain_vector.append(RELEVANCE_SCORE_FIX - pair[1])
 		idcg = [ideal_gain_vector[0]]
 		for i in range(1, len(ideal_gain_vector)):
-			idcg.append(ideal_gain_vector[i] / math.log(i + 1, 2) + idcg[-1])
+			idcg.append(ideal_gain_vector[i] / DISCOUNTS[i] + idcg[-1])
 
 		# Step four: NDCG (Normalised Discounted Cumulated Gain) at N.
 		ndcg_at_n = []
@@ -436,48 +507,61 @@ def ndcg_at_n(n):
 			yield query_ID, ndcg_at_n
 
 def print_evaluation_results():
+	relevance_sets = {query_ID : make_relevance_set(query_ID) for query_ID in relevance_scores}
+	retrieval_sets = {query_ID : make_retrieval_set(query_ID) for query_ID in relevance_scores}
+	# Relevant and retrieved documents of each query are the same for all
+	# evaluation methods, so they are built only once here.
 	print("Evaluation Results:")
-	print("Precision: {0}".format(precision()), end = "\n")
-	print("Recall: {0}".format(recall()), end = "\n")
-	print("P@{0}: {1}".format(N, p_at_n(N)), end = "\n")
-	print("Mean Average Precision: {0}".format(mean_average_precision()), end = "\n")
-	for query_ID, ndcg in ndcg_at_n(N):
+	print("Precision: {0}".format(precision(relevance_sets, retrieval_sets)), end = "\n")
+	print("Recall: {0}".format(recall(relevance_sets, retrieval_sets)), end = "\n")
+	print("P@{0}: {1}".format(N, p_at_n(relevance_sets, N)), end = "\n")
+	print("Mean Average Precision: {0}".format(mean_average_precision(relevance_sets)), end = "\n")
+	for query_ID, ndcg in ndcg_at_n(relevance_sets, N):
 		print("NDCG@{0} <Query {1}>: {2}".format(N, query_ID, ndcg), end = "\n")
 
 if __name__ == "__main__":
 	stemmer = porter.PorterStemmer()
 	stop_words = load_stop_words()
 	punctuation = string.punctuation[0 : 12] + string.punctuation[14:]
-	removing_punctuation_map = dict((ord(character), " ") for character in punctuation)
+	translation_map = dict((ord(character), " ") for character in punctuation)
 	# Remove all punctuations except full stops and hyphens.
+	translation_map[ord(".")] = None
+	# Delete full stops.
+	translation_map.update((ord(character), character.lower()) for character in string.ascii_uppercase)
+	# And convert letters to lowercase, so that a line is processed by a single
+	# `str.translate()` call instead of several string operations per term.
 	args = get_arguments()
 
 	if os.path.exists(INDEX_PATH):
 		print("[Loading BM25 index from file.]")
-		with open(INDEX_PATH, "r") as fp:
-			stemming, term_vectors, document_lengths = json.load(fp)
-
-		# Warning: unlike Python, `dict` type in JSON cannot have `int` key,
-		# therefore a conversion is of necessity.
-		document_lengths = {int(ID) : length for ID, length in document_lengths.items()}
-		for term, vector in term_vectors.items():
-			term_vectors[term] = {int(ID) : appearance_times for ID, appearance_times in vector.items()}
-		nums_of_documents = len(document_lengths)
-		# It is used in `bm25_similarities()` function.
+		with open(INDEX_PATH, "rb") as fp:
+			index = pickle.load(fp)
+		# Unlike JSON, pickle keeps document IDs as `int`, so no key conversion is needed here.
+		if index[0 : 4] != (INDEX_VERSION, K, B, COMMON_TERM_THRESHOLD):
+		# Weights in the index are calculated with `K` and `B`, and common terms
+		# are left out with `COMMON_TERM_THRESHOLD`, so the file is also outdated
+		# once they are changed.
+			sys.exit("[The index file is outdated; delete `{0}` and run the script again to regenerate it.]".format(INDEX_PATH))
+		term_weights, nums_of_documents = index[4 :]
+		# The header has been checked above.
+		term_weights = dict((term, (document_IDs.tolist(), weights.tolist())) for term, (document_IDs, weights) in term_weights.items())
+		# Both are kept as aligned lists in memory: iterating a list hands out
+		# existing objects whereas iterating an `array` creates a new one for
+		# every item, and this is the loop run for every query.
+		# `term_weights` and `nums_of_documents` are used in `bm25_similarities()` function.
 
 		if args.m == "manual":
 			manual_mode()
 		elif args.m == "evaluation":
 			relevance_scores = load_relevance_scores()
-			query_results = make_query_results()
+			query_results = make_query_results(args.j)
 			print_evaluation_results()
 			if args.o is not None: # If `-o` option is available.
 				with open(args.o, "w") as fp:
-					for query_ID, pair_list in query_results.items():
-						for pair in pair_list:
-							fp.write("{0} {1} {2}\n".format(query_ID, pair[0], pair[1]))
+					fp.write("".join("{0} {1} {2}\n".format(query_ID, document_ID, rank) for query_ID, pair_list in query_results.items() for document_ID, rank in pair_list))
+					# Format all lines first and write them at once.
 	else:
-	# For first-time running, it creates an index JSON file and exit.
+	# For first-time running, it creates an index file and exit.
 		print("[Generating the index file.]")
-		with open(INDEX_PATH, "w") as fp:
-			json.dump(process_documents(), fp)
+		with open(INDEX_PATH, "wb") as fp:
+			pickle.dump((INDEX_VERSION, K, B, COMMON_TERM_THRESHOLD) + process_documents(), fp, pickle.HIGHEST_PROTOCOL)